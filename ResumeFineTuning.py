@@ -1,6 +1,4 @@
-import numpy as np
 import tensorflow as tf
-import pandas as pd
 
 from classes.BaseModelFactory import BaseModelFactory
 from classes.RandomSeeder import RandomSeeder
@@ -17,7 +15,6 @@ class ResumeFineTuning:
     """
     def __init__(self, params):
         # Parámetros de preprocesamiento necesarios.
-        self.preprocessing_function = params["PREPROCESSING_FUNCTION"]
         self.batch_size = params["BATCH_SIZE"]
         self.base_model_name = params["BASE_MODEL_NAME"]
         self.model_series = params["MODEL_SERIES"]
@@ -43,6 +40,12 @@ class ResumeFineTuning:
         # Establecemos el entorno
         environment = Environment(environment_name)
 
+        # Fijamos la semilla aleatoria de Python, NumPy y TensorFlow para que
+        # la reanudación del entrenamiento sea reproducible. No se activa el
+        # determinismo de las operaciones de TensorFlow porque obligaría a
+        # cuDNN a utilizar algoritmos de convolución más lentos.
+        tf.keras.utils.set_random_seed(self.random_seed)
+
         """
         Obtenemos la configuración adecuada del entorno especificado.
         Se especifica que los directorios de datos de la sesión de 
@@ -62,6 +65,24 @@ class ResumeFineTuning:
         print("* INFORMACIÓN DEL ENTORNO                                     *")
         print("***************************************************************")
         environment.print_versions()
+
+        """
+        Activamos la precisión mixta (si la GPU disponible lo permite) antes
+        de construir cualquier modelo, para que las capas se creen ya con la
+        política adecuada.
+        """
+        mixed_precision = environment.set_mixed_precision_policy()
+        print("Precisión mixta      : ",
+              "activada" if mixed_precision else "no activada")
+
+        """
+        Utilizamos paralelismo de datos entre todas las GPU disponibles. El 
+        tamaño del batch indicado es por réplica, así que el tamaño global
+        del batch se escala según el número de réplicas.
+        """
+        strategy = tf.distribute.MirroredStrategy()
+        self.batch_size *= strategy.num_replicas_in_sync
+        print("Réplicas (GPU)       : ", strategy.num_replicas_in_sync)
         print()
 
         print("***************************************************************")
@@ -80,71 +101,83 @@ class ResumeFineTuning:
         """
         df_train, df_validation, df_test = dataset_manager.load_datasets()
 
-        print("Se han apartado " + str(len(df_train)) +
-              " ficheros para entrenamiento.")
-        print("Se han apartado " + str(len(df_validation)) +
-              " ficheros para validación.")
-        print("Se han apartado " + str(len(df_test)) +
-              " ficheros para test.")
+        print(f"Se han apartado {len(df_train)} ficheros para entrenamiento.")
+        print(f"Se han apartado {len(df_validation)} ficheros para validación.")
+        print(f"Se han apartado {len(df_test)} ficheros para test.")
 
-        # Obtenemos la definición del modelo base (pre-entrenado) a utilizar.
-        base_model_factory = BaseModelFactory()
-        base_model = base_model_factory.get_base_model(self.base_model_name)
-
-        # Obtenemos iteradores de imágenes para entrenamiento y validación.
+        """
+        Obtenemos iteradores de imágenes para entrenamiento y validación. Se
+        construyen fuera del ámbito de la estrategia de distribución y con
+        el tamaño de batch global: la estrategia se encarga de repartir cada
+        batch entre las réplicas.
+        """
+        img_width, img_height = BaseModelFactory.get_image_input_size_for(
+            model_name=self.base_model_name)
         self.iterator_training, self.iterator_validation \
             = dataset_manager.get_image_iterators(
-                preprocessing_function=self.preprocessing_function,
                 batch_size=self.batch_size,
-                img_width=base_model.img_width,
-                img_height=base_model.img_height,
-                brightness_min=self.brightness_min,
-                brightness_max=self.brightness_max)
+                img_width=img_width,
+                img_height=img_height)
 
         print()
         print("***************************************************************")
         print("* CONSTRUCCIÓN Y ENTRENAMIENTO DEL MODELO                     *")
         print("***************************************************************")
         print()
-        print("Nombre del modelo: ", base_model.model_name)
-
-        # Instanciamos un nuevo gestor de modelos.
-        model_manager = ModelManager(
-            configuration=environment_configuration,
-            model_name=base_model.model_name)
-
-        # Construimos el modelo final a partir del modelo base pre-entrenado.
-        model_manager.build_model(
-            base_model=base_model.model,
-            n_classes=self.n_classes
-        )
 
         """
-        Como estado inicial, debemos asegurarnos de que el modelo base está 
-        congelado.
+        Todas las variables del modelo (y del optimizador) deben crearse 
+        dentro del ámbito de la estrategia para que se repliquen en cada GPU.
         """
-        model_manager.freeze_base_model()
+        with strategy.scope():
+            # Obtenemos la definición del modelo base (pre-entrenado) a
+            # utilizar.
+            base_model_factory = BaseModelFactory()
+            base_model = base_model_factory.get_base_model(
+                self.base_model_name)
 
-        """
-        Fase de fine-tuning: preparamos y compilamos el modelo 
-        adecuadamente antes de continuar con esta fase del entrenamiento.
-        """
-        model_manager.prepare_model_for_fine_tune(
-            n_fine_tune_layer_from=base_model.fine_tune_layers[
-                self.fine_tune_start_block - 1])
+            print("Nombre del modelo: ", base_model.model_name)
+
+            # Instanciamos un nuevo gestor de modelos.
+            model_manager = ModelManager(
+                configuration=environment_configuration,
+                model_name=base_model.model_name)
+
+            # Construimos el modelo final a partir del modelo base
+            # pre-entrenado.
+            model_manager.build_model(
+                base_model=base_model.model,
+                n_classes=self.n_classes,
+                brightness_min=self.brightness_min,
+                brightness_max=self.brightness_max
+            )
+
+            """
+            Como estado inicial, debemos asegurarnos de que el modelo base 
+            está congelado.
+            """
+            model_manager.freeze_base_model()
+
+            """
+            Fase de fine-tuning: preparamos y compilamos el modelo 
+            adecuadamente antes de continuar con esta fase del entrenamiento.
+            """
+            fine_tune_from = base_model.fine_tune_layers[
+                self.fine_tune_start_block - 1]
+            model_manager.prepare_model_for_fine_tune(
+                n_fine_tune_layer_from=fine_tune_from)
 
         """
         Continuar con el entrenamiento fine-tuning a partir del estado en que se
         encontraba el modelo cuando se interrumpió el proceso (gracias a que 
         se guardó utilizando el callback de BackupRestore).
         """
-        model = model_manager.fine_tune_model(
+        model_manager.fine_tune_model(
             training_iterator=self.iterator_training,
             validation_iterator=self.iterator_validation,
             n_classes=self.n_classes,
             n_epochs=self.n_training_epochs,
-            n_fine_tune_layer_from=base_model.fine_tune_layers[
-                self.fine_tune_start_block - 1]
+            n_fine_tune_layer_from=fine_tune_from
         )
 
         print()
@@ -156,10 +189,10 @@ class ResumeFineTuning:
         Leer los ficheros de métricas que han sido previamente grabados en
         ficheros durante el entrenamiento
         """
-        history_phase_1 = pd.read_csv(
-            filepath_or_buffer=self.model_dir + '/classification_layers.csv')
-        history_phase_2 = pd.read_csv(
-            filepath_or_buffer=self.model_dir + '/fine_tune.csv')
+        history_phase_1 = ReportManager.read_history(
+            filename=self.model_dir + '/classification_layers.csv')
+        history_phase_2 = ReportManager.read_history(
+            filename=self.model_dir + '/fine_tune.csv')
 
         # Tras el entrenamiento del modelo, mostrar informes de resultados.
         ReportManager.plot_accuracy_loss(
@@ -182,17 +215,11 @@ class ResumeFineTuning:
                                           "(fase 2 - fine tuning)")
 
         """
-        Obtenemos la matriz de clases predichas de la red neuronal para cada
-        imagen de nuestro conjunto de datos. Las clases son índices.
-        """
-        validation_predicted = model.predict(self.iterator_validation)
-
-        """
-        Dado que la salida de la red neuronal utiliza hot-encoding, debemos 
-        traducirlas a valores de clase. Para ello podemos utilizar la función
-        argmax de Numpy.
+        Obtenemos la clase predicha por la red neuronal para cada imagen de 
+        nuestro conjunto de datos. Las clases son índices.
         """
-        validation_predicted_classes = np.argmax(validation_predicted, axis=1)
+        validation_predicted_classes = model_manager.predict_classes(
+            self.iterator_validation)
 
         """
         Por último mostramos el informe de clasificación final junto con la
@@ -215,9 +242,6 @@ class ResumeFineTuning:
 
 # Diccionario de parámetros
 parameters = {
-    # Función de pre-procesado a aplicar a las imágenes.
-    "PREPROCESSING_FUNCTION":
-        tf.keras.applications.efficientnet.preprocess_input,
     # Modelo pre-entrenado que se utilizará como base.
     "BASE_MODEL_NAME": "EfficientNetB0",
     "MODEL_SERIES": 1,
@@ -1,7 +1,3 @@
-import numpy as np
-import tensorflow as tf
-import pandas as pd
-
 from classes.BaseModelFactory import BaseModelFactory
 from classes.RandomSeeder import RandomSeeder
 from classes.ReportManager import ReportManager
@@ -19,7 +15,6 @@ class SingleModelling:
         # Parámetros de preprocesamiento necesarios.
         self.n_samples_validation = params["N_SAMPLES_VALIDATION"]
         self.n_samples_test = params["N_SAMPLES_TEST"]
-        self.preprocessing_function = params["PREPROCESSING_FUNCTION"]
         self.batch_size = params["BATCH_SIZE"]
         self.base_model_name = params["BASE_MODEL_NAME"]
         self.model_series = params["MODEL_SERIES"]
@@ -59,6 +54,17 @@ class SingleModelling:
         print("* INFORMACIÓN DEL ENTORNO                                     *")
         print("***************************************************************")
         environment.print_versions()
+
+        """
+        Activamos la precisión mixta (si la GPU disponible lo permite) antes
+        de construir cualquier modelo. Debe hacerse igual que en 
+        ResumeFineTuning: así el optimizador que se guarda en las 
+        salvaguardas (BackupAndRestore) tiene la misma estructura que el que
+        se utiliza al reanudar el entrenamiento.
+        """
+        mixed_precision = environment.set_mixed_precision_policy()
+        print("Precisión mixta      : ",
+              "activada" if mixed_precision else "no activada")
         print()
 
         print("***************************************************************")
@@ -90,12 +96,9 @@ class SingleModelling:
         # Obtenemos iteradores de imágenes para entrenamiento y validación.
         self.iterator_training, self.iterator_validation \
             = dataset_manager.get_image_iterators(
-                preprocessing_function=self.preprocessing_function,
                 batch_size=self.batch_size,
                 img_width=base_model.img_width,
-                img_height=base_model.img_height,
-                brightness_min=self.brightness_min,
-                brightness_max=self.brightness_max)
+                img_height=base_model.img_height)
 
         print()
         print("***************************************************************")
@@ -112,12 +115,14 @@ class SingleModelling:
         # Construimos el modelo final a partir del modelo base pre-entrenado.
         model_manager.build_model(
             base_model=base_model.model,
-            n_classes=self.n_classes
+            n_classes=self.n_classes,
+            brightness_min=self.brightness_min,
+            brightness_max=self.brightness_max
         )
 
         # Entrenar el modelo que tiene como base la red neuronal que
         # acabamos de crear anteriormente.
-        model = model_manager.train_model(
+        model_manager.train_model(
             training_iterator=self.iterator_training,
             validation_iterator=self.iterator_validation,
             n_classes=self.n_classes,
@@ -134,10 +139,10 @@ class SingleModelling:
         Leer los ficheros de métricas que han sido previamente grabados en
         ficheros durante el entrenamiento
         """
-        history_phase_1 = pd.read_csv(
-            filepath_or_buffer=self.model_dir + '/classification_layers.csv')
-        history_phase_2 = pd.read_csv(
-            filepath_or_buffer=self.model_dir + '/fine_tune.csv')
+        history_phase_1 = ReportManager.read_history(
+            filename=self.model_dir + '/classification_layers.csv')
+        history_phase_2 = ReportManager.read_history(
+            filename=self.model_dir + '/fine_tune.csv')
 
         # Tras el entrenamiento del modelo, mostrar informes de resultados.
         ReportManager.plot_accuracy_loss(
@@ -160,17 +165,11 @@ class SingleModelling:
                                           "(fase 2 - fine tuning)")
 
         """
-        Obtenemos la matriz de clases predichas de la red neuronal para cada
-        imagen de nuestro conjunto de datos. Las clases son índices.
-        """
-        validation_predicted = model.predict(self.iterator_validation)
-
-        """
-        Dado que la salida de la red neuronal utiliza hot-encoding, debemos 
-        traducirlas a valores de clase. Para ello podemos utilizar la función
-        argmax de Numpy.
+        Obtenemos la clase predicha por la red neuronal para cada imagen de 
+        nuestro conjunto de datos. Las clases son índices.
         """
-        validation_predicted_classes = np.argmax(validation_predicted, axis=1)
+        validation_predicted_classes = model_manager.predict_classes(
+            self.iterator_validation)
 
         """
         Por último mostramos el informe de clasificación final junto con la
@@ -197,9 +196,6 @@ parameters = {
     "N_SAMPLES_VALIDATION": 2533,
     # Número de imágenes del conjunto de test
     "N_SAMPLES_TEST": 2533,
-    # Función de pre-procesado a aplicar a las imágenes.
-    "PREPROCESSING_FUNCTION":
-        tf.keras.applications.efficientnet.preprocess_input,
     # Modelo pre-entrenado que se utilizará como base.
     "BASE_MODEL_NAME": "EfficientNetB0",
     "MODEL_SERIES": 1,
@@ -0,0 +1,38 @@
+import tensorflow as tf
+
+
+class BrightnessAugmentation(tf.keras.layers.Layer):
+    """
+    Capa de aumento de datos que ajusta de forma aleatoria el brillo de cada
+    imagen multiplicando el valor de sus píxeles por un factor entre
+    brightness_min y brightness_max (igual que el parámetro
+    "brightness_range" de ImageDataGenerator). El resultado se limita al
+    rango 0-255. Solo actúa durante el entrenamiento: en inferencia
+    devuelve las imágenes sin modificar.
+    """
+    def __init__(self, brightness_min: float, brightness_max: float,
+                 **kwargs):
+        super(BrightnessAugmentation, self).__init__(**kwargs)
+        # Cotas mínima y máxima del factor de brillo.
+        self.brightness_min = brightness_min
+        self.brightness_max = brightness_max
+
+    def call(self, inputs, training=None):
+        if not training:
+            return inputs
+
+        # Un factor de brillo distinto para cada imagen del batch.
+        factor = tf.random.uniform(
+            shape=[tf.shape(inputs)[0], 1, 1, 1],
+            minval=self.brightness_min,
+            maxval=self.brightness_max,
+            dtype=inputs.dtype)
+        return tf.clip_by_value(inputs * factor, 0.0, 255.0)
+
+    def get_config(self):
+        config = super(BrightnessAugmentation, self).get_config()
+        config.update({
+            "brightness_min": self.brightness_min,
+            "brightness_max": self.brightness_max
+        })
+        return config
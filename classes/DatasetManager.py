@@ -3,9 +3,11 @@ from typing import Tuple
 
 import pandas as pd
 import numpy as np
-from keras_preprocessing.image import ImageDataGenerator, DataFrameIterator
+import tensorflow as tf
 from sklearn.model_selection import train_test_split
 
+from classes.ImageDataset import ImageDataset
+
 
 class DatasetManager:
     """
@@ -23,6 +25,12 @@ class DatasetManager:
         self.df_images = self.get_image_dataframe(
             data_file=configuration["CLASSES_FILE"])
 
+        # Correspondencia entre el nombre de cada clase y su índice (por
+        # orden alfabético del nombre de clase).
+        self.class_indices = {
+            class_name: index for index, class_name in
+            enumerate(sorted(self.df_images["class"].unique()))}
+
         # Directorio donde se grabarán los ficheros de clase
         # correspondientes a los distintos conjuntos de datos que se vayan
         # creando (entrenamiento, validación y test)
@@ -34,13 +42,13 @@ class DatasetManager:
         self.df_validation = pd.DataFrame()
         self.df_test = pd.DataFrame()
 
-        # Iteradores de donde se obtendrán las imágenes del dataframe de
+        # Conjuntos de donde se obtendrán las imágenes del dataframe de
         # entrenamiento y validación.
         self.training_iterator = None
         self.validation_iterator = None
 
     def create_datasets(self, n_samples_validation: int, n_samples_test: int) \
-            -> Tuple[DataFrameIterator, DataFrameIterator, DataFrameIterator]:
+            -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
 
         """
         Divide el dataset en tres conjuntos. Uno para entrenamiento, otro para
@@ -129,158 +137,299 @@ class DatasetManager:
             columns=columns,
             index=False)
 
+        """
+        Además, se graban los tres conjuntos ya preparados (con la extensión
+        de los ficheros de imagen y la columna de clase) en formato Parquet.
+        Es un formato columnar y comprimido que se lee mucho más rápido que
+        un CSV y conserva los tipos de datos, así que es el que se utiliza 
+        para reanudar un entrenamiento. Los ficheros CSV se mantienen porque
+        se utilizan en otros procesos (por ejemplo, el modelo ensamblado).
+        """
+        for name, df in (('train', self.df_train),
+                         ('validation', self.df_validation),
+                         ('test', self.df_test)):
+            df_copy = df.copy()
+            df_copy['class'] = df_copy['class'].astype('category')
+            df_copy.to_parquet(
+                path=self.datasets_dir + '/' + name + '.parquet',
+                engine='pyarrow',
+                compression='zstd',
+                index=False)
+
         return self.df_train, self.df_validation, self.df_test
 
     def load_datasets(self):
         """
         Carga los conjuntos de entrenamiento, validación y test previamente
-        grabados a disco en formato CSV.
+        grabados a disco. Se utilizan los ficheros en formato Parquet si 
+        existen y, si no (conjuntos creados con una versión anterior), los
+        ficheros CSV.
         """
-        self.df_train = self.get_image_dataframe(self.datasets_dir +
-                                                 '/train.csv')
-        self.df_validation = self.get_image_dataframe(self.datasets_dir +
-                                                      '/validation.csv')
-        self.df_test = self.get_image_dataframe(self.datasets_dir +
-                                                '/test.csv')
+        self.df_train = self.__load_dataset('train')
+        self.df_validation = self.__load_dataset('validation')
+        self.df_test = self.__load_dataset('test')
 
         return self.df_train, self.df_validation, self.df_test
 
-    def get_image_iterators(self, preprocessing_function, batch_size: int,
-                            img_width: int, img_height: int,
-                            brightness_min: float, brightness_max: float) -> \
-            Tuple[DataFrameIterator, DataFrameIterator]:
+    def __load_dataset(self, name: str) -> pd.DataFrame:
+        """
+        Carga uno de los conjuntos de datos grabados en el directorio de
+        datasets.
+
+        :param name: nombre del conjunto ('train', 'validation' o 'test').
+        :return: el dataframe del conjunto de datos.
+        """
+        parquet_file = self.datasets_dir + '/' + name + '.parquet'
+        if os.path.isfile(parquet_file):
+            return pd.read_parquet(path=parquet_file, engine='pyarrow')
+
+        return self.get_image_dataframe(self.datasets_dir + '/' + name +
+                                        '.csv')
+
+    def get_image_iterators(self, batch_size: int,
+                            img_width: int, img_height: int) -> \
+            Tuple[ImageDataset, ImageDataset]:
 
         """
-        Este método obtiene los iteradores de imágenes adecuados para
+        Este método obtiene los conjuntos de imágenes adecuados para
         entrenamiento y validación.
 
-        :param preprocessing_function: función de pre-procesado que se
-         aplicarán a las imágenes tras efectuar las operaciones de aumento
-         de datos. Esta función de pre-procesado depende de la red
-         pre-entrenada que se utilice posteriormente.
-        :param batch_size: tamaño del batch que utilizarán los iteradores de
+        :param batch_size: tamaño del batch que utilizarán los conjuntos de
          imágenes.
         :param img_width: anchura en píxeles que adoptarán las imágenes que
-         se obtendrán con los iteradores.
+         se obtendrán de los conjuntos.
         :param img_height: altura en píxeles que adoptarán las imágenes que
-         se obtendrán con los iteradores.
-        :param brightness_min: cota mínima de cambio de brillo aleatorio a
-         utilizar durante el aumento de datos.
-        :param brightness_max: cota máxima de cambio de brillo aleatorio a
-         utilizar durante el aumento de datos.
+         se obtendrán de los conjuntos.
         :return:
-            - training_iterator: iterador que proporcionará las imágenes de
+            - training_iterator: conjunto que proporcionará las imágenes de
             entrenamiento. Se aplicarán técnicas de aumento de datos a estas
             imágenes.
-            - validation_iterator: iterador que proporcionará las imágenes de
+            - validation_iterator: conjunto que proporcionará las imágenes de
             validación. No se aplicará ninguna técnica de aumento de datos a
             estas imágenes.
         """
+        self.training_iterator = ImageDataset(
+            dataset=self.build_tf_dataset(
+                df=self.df_train,
+                batch_size=batch_size,
+                img_width=img_width,
+                img_height=img_height,
+                training=True),
+            filenames=self.df_train["image"].tolist(),
+            labels=self.get_labels(self.df_train),
+            class_indices=self.class_indices,
+            batch_size=batch_size)
 
         """
-        En primer lugar debemos instanciar dos objetos ImageDataGenerator. 
-        Uno estará dedicado al conjunto de datos de entrenamiento y el otro a
-        los datos de validación. La diferencia entre ambos es que solo el 
-        generador de imágenes de entrenamiento aplicará técnicas de aumento 
-        de datos.
-        La única operación común que ambos efectuarán, será la de reescalar 
-        el valor de los píxeles de las imágenes utilizando el parámetro 
-        "rescale".
-        
-        Generador de datos de entrenamiento.
-        
-        Parámetros:
-        - preprocessing_function: Utilizamos la función de preprocesamiento 
-        para asegurar que cada imagen de entrada sea pre-procesada de 
-        acuerdo con las características que el modelo base necesita.
-        - horizontal_flip: Se aplicará la técnica de aumento de datos de 
-        manera aleatoria mediante volteos horizontales de las imágenes.
-        - vertical_flip: Se aplicará la técnica de aumento de datos de 
-        manera aleatoria mediante volteos verticales de las imágenes.
-        - brightness_range: Se aplicará la técnica de aumento de datos de 
-        manera aleatoria mediante el ajuste aleatorio del brillo de las 
-        imágenes.
-        """
-        idg_training = ImageDataGenerator(
-            preprocessing_function=preprocessing_function,
-            horizontal_flip=True,
-            vertical_flip=True,
-            brightness_range=(brightness_min, brightness_max))
-
-        """
-        Generador de datos de validación. No aplicará ninguna técnica de 
-        aumento de datos, solo se mantendrá el re-escalado de los valores de 
-        los píxeles de las imágenes idéntico al que se aplica a las imágenes 
-        de entrenamiento y el preprocesamiento adecuado para la red 
-        pre-entrenada.
-        """
-        idg_validation = ImageDataGenerator(
-            preprocessing_function=preprocessing_function)
-
-        """
-        Utilizamos el método flow_from_dataframe para obtener dos iteradores (
-        generadores de Python).
-        Uno servirá para obtener las imágenes del conjunto de entrenamiento y 
-        el otro para obtener las imágenes del conjunto de validación/test.
-        Es importante que cada iterador se obtenga del generador adecuado. 
-        El iterador de datos de entrenamiento se obtiene del generador de 
-        datos de entrenamiento y análogamente para el de validación.
+        En el caso del conjunto de validación, es muy importante que las 
+        imágenes no se barajen. Esto facilita la utilización posterior de 
+        funciones como predict y classification_report para evaluar el 
+        modelo al garantizarse un orden bien definido de los elementos 
+        devueltos.
         
-        Parámetros:
-        - dataframe: dataframe de donde se obtienen las imágenes de 
-        entrenamiento.
-        - directory: directorio donde se encuentran las imágenes.
-        - x_col: indica la columna del dataframe que contiene el nombre de 
-        cada fichero de imagen.
-        - y_col: indica toda la serie de columnas de clase.
-        - class_mode: especifica qué formato tienen los marcadores de clase.
-        Utilizamos "raw" para especificar una serie de columnas numéricas que, 
-        una vez unidas, expresan la clase utilizando el método de 
-        one-hot-encoding.
-        - target_size: todas las imágenes leídas se cambiarán al tamaño 
-        establecido por estas dimensiones.
-        - interpolation: método utilizado durante la operación de cambio de
-        tamaño.
-        - seed: fija semilla aleatoria que se utiliza durante algunas 
-        transformaciones y el orden de extracción de las imágenes del dataframe.
-        """
-        self.training_iterator = idg_training.flow_from_dataframe(
-            dataframe=self.df_train,
-            directory=self.dir_images,
-            x_col="image",
-            y_col="class",
-            class_mode="categorical",
-            color_mode="rgb",
-            shuffle=True,
-            batch_size=batch_size,
-            target_size=(img_width, img_height),
-            interpolation="nearest",
-            seed=self.random_seed)
-
-        """
-        En el caso de la obtención del iterador del conjunto de validación, 
-        es muy importante indicar shuffle=False. Esto facilita la utilización
-        posterior de funciones como predict y classification_report para 
-        evaluar el modelo al garantizarse un orden bien definido de los 
-        elementos devueltos.
-        """
-        self.validation_iterator = idg_validation.flow_from_dataframe(
-            dataframe=self.df_validation,
-            directory=self.dir_images,
-            x_col="image",
-            y_col="class",
-            class_mode="categorical",
-            color_mode="rgb",
-            shuffle=False,
-            batch_size=batch_size,
-            target_size=(img_width, img_height),
-            interpolation="nearest",
-            seed=self.random_seed)
-
-        # Devolvemos los iteradores de imágenes para entrenamiento y
+        Las imágenes de validación no cambian entre épocas (ni entre 
+        sesiones de entrenamiento), así que se decodifican y redimensionan 
+        una sola vez y se guardan (en formato PNG, sin pérdida) en un fichero
+        TFRecord junto a los ficheros de los conjuntos de datos. Si el 
+        entrenamiento se reanuda, el fichero ya existirá y se reutilizará.
+        """
+        validation_tfrecord_file = self.datasets_dir + '/validation_' + \
+            str(img_width) + 'x' + str(img_height) + '_png.tfrecord'
+        if not os.path.isfile(validation_tfrecord_file):
+            self.write_validation_tfrecord(
+                df_validation=self.df_validation,
+                out_path=validation_tfrecord_file,
+                img_width=img_width,
+                img_height=img_height)
+
+        self.validation_iterator = ImageDataset(
+            dataset=self.build_tf_dataset(
+                df=self.df_validation,
+                batch_size=batch_size,
+                img_width=img_width,
+                img_height=img_height,
+                training=False,
+                tfrecord_file=validation_tfrecord_file),
+            filenames=self.df_validation["image"].tolist(),
+            labels=self.get_labels(self.df_validation),
+            class_indices=self.class_indices,
+            batch_size=batch_size)
+
+        # Devolvemos los conjuntos de imágenes para entrenamiento y
         # validación respectivamente.
         return self.training_iterator, self.validation_iterator
 
+    def build_tf_dataset(self, df: pd.DataFrame, batch_size: int,
+                         img_width: int, img_height: int,
+                         training: bool,
+                         tfrecord_file: str = None) -> tf.data.Dataset:
+        """
+        Construye un tf.data.Dataset a partir de un dataframe de imágenes.
+        La lectura, decodificación y aumento de datos de las imágenes se
+        efectúan en paralelo mientras el modelo entrena con el batch anterior.
+        Las imágenes se mantienen como uint8: la conversión a coma flotante
+        se hace ya en la GPU, dentro del propio modelo.
+
+        :param df: dataframe con los nombres de fichero y la clase de cada
+         imagen.
+        :param batch_size: tamaño del batch.
+        :param img_width: anchura en píxeles de las imágenes resultantes.
+        :param img_height: altura en píxeles de las imágenes resultantes.
+        :param training: si es True, las imágenes se barajan y se aplican
+         técnicas de aumento de datos. Si es False, las imágenes decodificadas
+         se guardan en memoria tras la primera época.
+        :param tfrecord_file: fichero TFRecord (generado con
+         write_validation_tfrecord) con las imágenes ya redimensionadas. Si se indica, las imágenes se leen de este fichero
+         en lugar de los ficheros JPEG originales.
+        :return: el dataset, que proporciona tuplas (imágenes uint8, clases
+         en one-hot-encoding).
+        """
+        n_classes = len(self.class_indices)
+
+        def load_image(filename, label):
+            """
+            Lee y decodifica una imagen y la redimensiona.
+            """
+            return self.__read_image(filename, img_width, img_height), \
+                tf.one_hot(label, n_classes)
+
+        def parse_example(example):
+            """
+            Extrae una imagen ya redimensionada y su clase de un registro
+            TFRecord.
+            """
+            features = tf.io.parse_single_example(
+                example,
+                features={
+                    "image": tf.io.FixedLenFeature([], tf.string),
+                    "label": tf.io.FixedLenFeature([], tf.int64)
+                })
+            image = tf.io.decode_png(features["image"], channels=3)
+            image = tf.ensure_shape(image, (img_height, img_width, 3))
+            return image, tf.one_hot(features["label"], n_classes)
+
+        def augment_image(image, label):
+            """
+            Aplica de forma aleatoria volteos horizontales y verticales. El
+            ajuste aleatorio del brillo se efectúa ya en la GPU, dentro del
+            propio modelo.
+            """
+            image = tf.image.random_flip_left_right(image)
+            image = tf.image.random_flip_up_down(image)
+            return image, label
+
+        if tfrecord_file is not None:
+            dataset = tf.data.TFRecordDataset(
+                tfrecord_file,
+                num_parallel_reads=tf.data.AUTOTUNE)
+            dataset = dataset.map(parse_example,
+                                  num_parallel_calls=tf.data.AUTOTUNE)
+        else:
+            dataset = tf.data.Dataset.from_tensor_slices(
+                ((self.dir_images + "/" + df["image"]).tolist(),
+                 self.get_labels(df)))
+
+            if training:
+                dataset = dataset.shuffle(buffer_size=len(df),
+                                          seed=self.random_seed,
+                                          reshuffle_each_iteration=True)
+
+            dataset = dataset.map(load_image,
+                                  num_parallel_calls=tf.data.AUTOTUNE)
+
+        if training:
+            dataset = dataset.map(augment_image,
+                                  num_parallel_calls=tf.data.AUTOTUNE)
+
+        if not training:
+            dataset = dataset.cache()
+
+        dataset = dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+        """
+        En el conjunto de entrenamiento (que ya se baraja) no es necesario
+        mantener el orden de los elementos: se permite que las operaciones 
+        en paralelo los devuelvan según vayan terminando. En el conjunto de
+        validación sí se mantiene, ya que las predicciones deben 
+        corresponderse con las clases reales en el mismo orden.
+        """
+        if training:
+            options = tf.data.Options()
+            options.deterministic = False
+            options.autotune.enabled = True
+            options.threading.private_threadpool_size = os.cpu_count()
+            dataset = dataset.with_options(options)
+
+        return dataset
+
+    def write_validation_tfrecord(self, df_validation: pd.DataFrame,
+                                  out_path: str, img_width: int,
+                                  img_height: int) -> None:
+        """
+        Graba las imágenes de un dataframe (normalmente, el de validación) en
+        un fichero TFRecord. Cada registro contiene la imagen ya 
+        redimensionada, codificada en PNG (sin pérdida y mucho más compacta 
+        que los píxeles en bruto), y el índice de su clase. El orden de los
+        registros es el mismo que el del dataframe.
+
+        :param df_validation: dataframe de imágenes a grabar.
+        :param out_path: ruta del fichero TFRecord.
+        :param img_width: anchura en píxeles de las imágenes grabadas.
+        :param img_height: altura en píxeles de las imágenes grabadas.
+        """
+        dataset = tf.data.Dataset.from_tensor_slices(
+            ((self.dir_images + "/" + df_validation["image"]).tolist(),
+             self.get_labels(df_validation)))
+        dataset = dataset.map(
+            lambda filename, label: (
+                tf.io.encode_png(
+                    self.__read_image(filename, img_width, img_height)),
+                label),
+            num_parallel_calls=tf.data.AUTOTUNE)
+
+        """
+        Se graba primero en un fichero temporal. Así, si el proceso se 
+        interrumpe a medias, no queda un fichero incompleto que se 
+        reutilizaría al reanudar el entrenamiento.
+        """
+        with tf.io.TFRecordWriter(out_path + '.tmp') as writer:
+            for png_image, label in dataset:
+                example = tf.train.Example(features=tf.train.Features(feature={
+                    "image": tf.train.Feature(bytes_list=tf.train.BytesList(
+                        value=[png_image.numpy()])),
+                    "label": tf.train.Feature(int64_list=tf.train.Int64List(
+                        value=[label.numpy()]))
+                }))
+                writer.write(example.SerializeToString())
+
+        os.replace(out_path + '.tmp', out_path)
+
+    @staticmethod
+    def __read_image(filename, img_width: int, img_height: int) -> tf.Tensor:
+        """
+        Lee y decodifica una imagen JPEG y la redimensiona utilizando el
+        método del vecino más próximo ("nearest"). El resultado mantiene el
+        tipo uint8.
+
+        :param filename: ruta del fichero de imagen.
+        :param img_width: anchura en píxeles de la imagen resultante.
+        :param img_height: altura en píxeles de la imagen resultante.
+        :return: tensor de la imagen.
+        """
+        image = tf.io.decode_jpeg(tf.io.read_file(filename), channels=3)
+        return tf.image.resize(image, size=(img_height, img_width),
+                               method="nearest")
+
+    def get_labels(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Obtiene el índice de la clase de cada imagen de un dataframe.
+
+        :param df: dataframe de imágenes.
+        :return: array con el índice de clase de cada imagen.
+        """
+        return df["class"].astype(str).map(self.class_indices).to_numpy(
+            dtype=np.int32)
+
     @staticmethod
     def get_image_dataframe(data_file: str):
         """
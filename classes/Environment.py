@@ -38,6 +38,29 @@ class Environment:
         print("GPU                  : ",
               "disponible" if gpu else "no disponible")
 
+    @staticmethod
+    def set_mixed_precision_policy() -> bool:
+        """
+        Activa la política de precisión mixta ("mixed_float16") de Keras si
+        todas las GPU disponibles tienen una capacidad de cómputo 7.0 o
+        superior (es decir, disponen de Tensor Cores). En GPU más antiguas
+        (por ejemplo, K80) o sin GPU no se obtiene ninguna mejora, por lo que
+        se mantiene la política por defecto (float32).
+
+        :return: True si se ha activado la precisión mixta, False en otro caso.
+        """
+        gpus = tf.config.list_physical_devices('GPU')
+        if not gpus:
+            return False
+
+        for gpu in gpus:
+            details = tf.config.experimental.get_device_details(gpu)
+            if details.get('compute_capability', (0, 0)) < (7, 0):
+                return False
+
+        tf.keras.mixed_precision.set_global_policy('mixed_float16')
+        return True
+
     def get_config(self, reset_dirs: bool = True) -> dict:
         """
         Obtiene el diccionario con las variables de configuración del entorno.
@@ -0,0 +1,29 @@
+import math
+
+
+class ImageDataset:
+    """
+    Esta clase representa un conjunto de imágenes preparado como un
+    tf.data.Dataset junto con la información de los ficheros y las clases
+    que lo componen (en el mismo orden en que el dataset las proporciona si
+    no se barajan).
+    """
+    def __init__(self, dataset, filenames, labels, class_indices,
+                 batch_size):
+        # Dataset de TensorFlow que proporciona los batches de imágenes.
+        self.dataset = dataset
+        # Nombres de los ficheros de imagen.
+        self.filenames = filenames
+        # Índice de la clase a la que pertenece cada imagen.
+        self.labels = labels
+        self.classes = labels
+        # Correspondencia entre el nombre de cada clase y su índice.
+        self.class_indices = class_indices
+        # Tamaño del batch.
+        self.batch_size = batch_size
+
+    def __len__(self):
+        """
+        Número de batches que proporciona el dataset en cada época.
+        """
+        return math.ceil(len(self.labels) / self.batch_size)
@@ -4,15 +4,16 @@ import timeit
 
 import tensorflow as tf
 import numpy as np
-from keras_preprocessing.image import DataFrameIterator
 from sklearn.utils import class_weight
-from tensorflow.keras import Model
+from tensorflow.keras import Model, mixed_precision
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
 from tensorflow.keras.layers import (
-    Dense, Dropout, BatchNormalization)
+    Activation, Dense, Dropout, BatchNormalization, Input, Rescaling)
 from tensorflow.keras.optimizers import Adam
 from tensorflow.python.keras.callbacks import Callback, CSVLogger
 
+from classes.BrightnessAugmentation import BrightnessAugmentation
+from classes.ImageDataset import ImageDataset
 from classes.ModelMetrics import ModelMetrics
 
 
@@ -59,8 +60,16 @@ class ModelManager:
         """
         self.model_name = model_name
 
+        """
+        Función (tf.function) que obtiene las clases predichas de un batch.
+        Se crea la primera vez que se necesita y se reutiliza en las 
+        siguientes llamadas (por ejemplo, al final de cada época) para no
+        tener que volver a trazar el grafo.
+        """
+        self.predict_batch_function = None
+
     @staticmethod
-    def get_class_weights(image_iterator: DataFrameIterator) -> dict:
+    def get_class_weights(image_iterator: ImageDataset) -> dict:
         """
         Función que obtiene un diccionario de pesos por clase según su grado de
         aparición en el conjunto de datos referenciado por el iterador de
@@ -80,7 +89,9 @@ class ModelManager:
             y=image_iterator.labels)
         return dict(enumerate(class_weights))
 
-    def build_model(self, base_model: Model, n_classes: int) -> None:
+    def build_model(self, base_model: Model, n_classes: int,
+                    brightness_min: float = None,
+                    brightness_max: float = None) -> None:
         """
         Este método construye el modelo que se entrenará posteriormente.
         Se utilizará la técnica de transferencia de aprendizaje: a un
@@ -94,15 +105,40 @@ class ModelManager:
         construido.
         :param n_classes: Número de clases posible que deberá predecir el
         modelo.
+        :param brightness_min: cota mínima de cambio de brillo aleatorio a
+        utilizar durante el aumento de datos. Si no se indica, no se aplica.
+        :param brightness_max: cota máxima de cambio de brillo aleatorio a
+        utilizar durante el aumento de datos. Si no se indica, no se aplica.
         :return: El modelo completo listo para ser entrenado.
         """
 
+        self.model_base = base_model
+
+        """
+        Las imágenes llegan al modelo como enteros uint8 (así se reduce a la 
+        cuarta parte el volumen de datos que se transfiere a la GPU). La
+        primera capa las convierte al tipo de cómputo del modelo (float16 si
+        se utiliza precisión mixta). No es necesario normalizarlas aquí: los
+        modelos EfficientNet de Keras ya incluyen sus propias capas de
+        normalización y esperan valores de píxel entre 0 y 255.
+        """
+        inputs = Input(shape=self.model_base.input_shape[1:], dtype="uint8")
+        x = Rescaling(scale=1.0)(inputs)
+
+        """
+        Aumento de datos mediante un ajuste aleatorio del brillo, que se
+        efectúa en la GPU. Esta capa solo actúa durante el entrenamiento: en
+        inferencia (validación y predicción) no modifica las imágenes.
+        """
+        if brightness_min is not None and brightness_max is not None:
+            x = BrightnessAugmentation(brightness_min=brightness_min,
+                                       brightness_max=brightness_max)(x)
+
         """
         Definimos las capas que sustituirán a la última capa del modelo base.
-        Partiendo de la última capa de salida del modelo base...
+        Partiendo de la salida del modelo base...
         """
-        self.model_base = base_model
-        x = self.model_base.output
+        x = self.model_base(x)
 
         """
         ...añadimos nuestra capas de tratamiento específicas a nuestro
@@ -114,19 +150,27 @@ class ModelManager:
         """
         x = Dense(1024, activation="relu")(x)
         x = Dropout(0.2)(x)
-        self.model_classification_layers = Dense(units=n_classes,
-                                                 activation="softmax")(x)
+        x = Dense(units=n_classes)(x)
+
+        """
+        La activación "softmax" se calcula siempre en float32. Si se está
+        utilizando precisión mixta, esto mantiene la estabilidad numérica de
+        la función de pérdida.
+        """
+        self.model_classification_layers = Activation(activation="softmax",
+                                                      dtype="float32")(x)
 
         """
         Construimos nuestro modelo completo uniendo la red del modelo base ya 
         entrenada al principio y las capas clasificadores completamente 
         conectadas que hemos añadido justamente después.
         """
-        self.model_complete = Model(inputs=self.model_base.input,
+        self.model_complete = Model(inputs=inputs,
                                     outputs=self.model_classification_layers)
+        self.predict_batch_function = None
 
-    def train_model(self, training_iterator: DataFrameIterator,
-                    validation_iterator: DataFrameIterator, n_classes: int,
+    def train_model(self, training_iterator: ImageDataset,
+                    validation_iterator: ImageDataset, n_classes: int,
                     n_epochs: int, n_fine_tune_layer_from: int):
         """
         Método que se encarga de entrenar un modelo base previamente
@@ -177,10 +221,15 @@ class ModelManager:
             """
             self.freeze_base_model()
 
-            # Por último, compilamos el modelo.
+            """
+            Por último, compilamos el modelo. Se indica explícitamente que no
+            se ejecute en modo "eager" para que Keras compile el paso de 
+            entrenamiento como un grafo (tf.function).
+            """
             self.model_complete.compile(optimizer=Adam(learning_rate=0.001),
                                         loss="categorical_crossentropy",
-                                        metrics=["accuracy"])
+                                        metrics=["accuracy"],
+                                        run_eagerly=False)
 
             """
             Efectuamos la primera fase del entrenamiento: solo las capas
@@ -236,19 +285,44 @@ class ModelManager:
         "Starting in TensorFlow 2.0, setting bn.trainable = False will also
          force the layer to run in inference mode."
         """
-        for layer in self.model_base.layers[n_fine_tune_layer_from:]:
-            if not isinstance(layer, BatchNormalization):
-                layer.trainable = True
+        self.model_base.trainable = True
+        for layer in self.model_base.layers[:n_fine_tune_layer_from]:
+            layer.trainable = False
+        for layer in self.model_base.layers:
+            if isinstance(layer, BatchNormalization):
+                layer.trainable = False
         """
         Re-compilamos el modelo para la etapa de entrenamiento de 
         fine_tuning. La diferencia esta vez, es que utilizamos una tasa de 
         aprendizaje muy baja (aquí, diez veces más baja que la utilizada 
         en la primera fase de entrenamiento).
         """
+        optimizer = Adam(learning_rate=0.0001)
+
+        """
+        Con precisión mixta, el optimizador debe escalar la pérdida para
+        evitar que los gradientes en float16 se anulen (underflow).
+        """
+        if mixed_precision.global_policy().name == "mixed_float16":
+            optimizer = mixed_precision.LossScaleOptimizer(optimizer)
+
+        """
+        Se activa la compilación XLA del paso de entrenamiento: las numerosas
+        operaciones elemento a elemento de los bloques de EfficientNet 
+        (Swish, Squeeze-and-Excitation, BatchNormalization) se fusionan en 
+        un número reducido de kernels.
+        Además, se ejecutan varios batches en cada llamada al grafo 
+        (steps_per_execution) para reducir la sincronización con Python 
+        entre pasos. Todos los callbacks que se utilizan trabajan a nivel de
+        época, así que no se ven afectados.
+        """
         self.model_complete.compile(
-            optimizer=Adam(learning_rate=0.0001),
+            optimizer=optimizer,
             loss='categorical_crossentropy',
-            metrics=['accuracy'])
+            metrics=['accuracy'],
+            run_eagerly=False,
+            jit_compile=True,
+            steps_per_execution=16)
 
     def fine_tune_model(self, n_classes, n_epochs, n_fine_tune_layer_from,
                         training_iterator, validation_iterator):
@@ -278,20 +352,23 @@ class ModelManager:
         Tomando la idea de Chollet (2019), podemos aplicar 
         pesos a las clases para corregir el desequilibrio entre ellas a 
         través del parámetro "class_weight".
+        Con verbose=2 se muestra una sola línea por época (en lugar de una
+        barra de progreso actualizada tras cada batch).
         """
         start_phase = timeit.default_timer()
         history_phase_2 = self.model_complete.fit(
-            training_iterator,
+            training_iterator.dataset,
             steps_per_epoch=len(training_iterator),
             epochs=n_epochs,
-            validation_data=validation_iterator,
+            validation_data=validation_iterator.dataset,
             validation_steps=len(validation_iterator),
             callbacks=self.__get_callbacks(
                 n_classes=n_classes,
                 validation_iterator=validation_iterator,
                 training_session_name='fine_tune'
             ),
-            class_weight=self.get_class_weights(training_iterator)
+            class_weight=self.get_class_weights(training_iterator),
+            verbose=2
         )
         end_phase = timeit.default_timer()
         print("Ha terminado la fase 2. Tiempo total transcurrido (segundos): ",
@@ -330,10 +407,10 @@ class ModelManager:
         """
         start_phase = timeit.default_timer()
         history_phase_1 = self.model_complete.fit(
-            training_iterator,
+            training_iterator.dataset,
             steps_per_epoch=len(training_iterator),
             epochs=n_epochs,
-            validation_data=validation_iterator,
+            validation_data=validation_iterator.dataset,
             validation_steps=len(validation_iterator),
             callbacks=self.__get_callbacks(
                 n_classes=n_classes,
@@ -438,17 +515,47 @@ class ModelManager:
 
     def show_trainable_layers(self) -> None:
         """
-        Muestra el listado de las capas del modelo base indicando cuáles son
-        entrenables y cuáles no lo están (es decir, están "congeladas").
+        Muestra el listado de las capas del modelo base (seguidas de las
+        capas clasificadoras) indicando cuáles son entrenables y cuáles no lo
+        están (es decir, están "congeladas"). La numeración de las capas del
+        modelo base es la misma que se utiliza para indicar a partir de qué
+        capa se efectúa el fine tuning.
         :return: Nada
         """
         if self.model_complete is None:
             raise Exception("¡El modelo debe construirse primero!")
         else:
-            for i, layer in enumerate(self.model_complete.layers):
+            layers = self.model_base.layers + self.model_complete.layers[
+                self.model_complete.layers.index(self.model_base) + 1:]
+            for i, layer in enumerate(layers):
                 print("Capa:", str(i).rjust(3), "(", layer.name,
                       ") - Trainable:", layer.trainable)
 
+    def predict_classes(self, image_iterator: ImageDataset) -> np.ndarray:
+        """
+        Obtiene la clase predicha por el modelo para cada imagen del conjunto
+        especificado. La operación argmax se calcula en el dispositivo batch
+        a batch, de forma que solo se transfieren los índices de clase (en
+        lugar de la matriz completa de probabilidades).
+
+        :param image_iterator: conjunto de imágenes.
+        :return: array con el índice de la clase predicha para cada imagen.
+        """
+        if self.model_complete is None:
+            raise Exception("¡El modelo debe construirse primero!")
+
+        if self.predict_batch_function is None:
+            @tf.function
+            def predict_batch(images):
+                return tf.argmax(self.model_complete(images, training=False),
+                                 axis=1, output_type=tf.int32)
+
+            self.predict_batch_function = predict_batch
+
+        return np.concatenate(
+            [self.predict_batch_function(images).numpy()
+             for images, _ in image_iterator.dataset])
+
     def load_model(self) -> None:
         """
         Carga el modelo previamente grabado en un fichero. Se asume que dicho
@@ -456,17 +563,21 @@ class ModelManager:
         "EfficientNetB1.hdf5", etc.)
         """
         self.model_complete = tf.keras.models.load_model(
-            filepath=self.model_dir + "/" + self.model_name + ".hdf5")
+            filepath=self.model_dir + "/" + self.model_name + ".hdf5",
+            custom_objects={"BrightnessAugmentation": BrightnessAugmentation})
+        self.predict_batch_function = None
 
     def generate_submission_file(self,
-                                 image_iterator: DataFrameIterator,
+                                 image_iterator: ImageDataset,
                                  directory: str = None,
-                                 filename: str = 'submission.csv') -> None:
+                                 filename: str = 'submission.csv') \
+            -> np.ndarray:
         """
         Genera el fichero de predicciones del modelo utilizando las imágenes
         del iterador especificado.
 
-        :return: Nada
+        :return: la matriz de probabilidades predichas para cada imagen y
+        clase (la misma que se ha grabado en el fichero).
         """
 
         if self.model_complete is None:
@@ -480,7 +591,7 @@ class ModelManager:
             Obtenemos la matriz de clases predichas de la red neuronal para 
             cada imagen de nuestro conjunto de datos de test.
             """
-            predicted = self.model_complete.predict(image_iterator)
+            predicted = self.model_complete.predict(image_iterator.dataset)
 
             """
             Obtenemos la lista de ficheros de test. Solo los nombres, ignoramos 
@@ -512,3 +623,5 @@ class ModelManager:
 
                 # Escribimos las líneas de predicciones
                 writer.writerows(predictions)
+
+            return predicted
@@ -5,12 +5,12 @@ from pathlib import Path
 import numpy as np
 import tensorflow as tf
 from isic_challenge_scoring import ClassificationScore
-from keras_preprocessing.image import DataFrameIterator
 from sklearn.metrics import f1_score, precision_score, recall_score, \
     balanced_accuracy_score
 from tensorflow.keras.callbacks import Callback
 
 from classes import ModelManager
+from classes.ImageDataset import ImageDataset
 
 """
 Clase que define un callback de Keras cuyo objetivo es el de calcular 
@@ -33,7 +33,7 @@ class ModelMetrics(Callback):
     """
 
     def __init__(self,
-                 validation_iterator: DataFrameIterator,
+                 validation_iterator: ImageDataset,
                  n_classes: int,
                  temp_dir: str,
                  environment_name: str,
@@ -104,14 +104,24 @@ class ModelMetrics(Callback):
         Función que se ejecuta al finalizar cada época de entrenamiento.
         """
 
+        """
+        Graba las predicciones del conjunto de validación en un fichero 
+        temporal (necesario para calcular la métrica de ISIC 2019). Si ya 
+        existía (de una época anterior) simplemente se sobreescribirá.
+        """
+        val_probabilities = self.model_manager.generate_submission_file(
+            image_iterator=self.validation_iterator,
+            directory=self.temp_dir,
+            filename='predictions.csv')
+
         """
         Obtener las clases predichas por el modelo para cada imagen del 
-        conjunto de validación. Dado que la salida de la red neuronal utiliza
-        hot-encoding, debemos traducirlas a valores de clase. Para ello 
-        podemos utilizar la función de argmax de Numpy.
+        conjunto de validación a partir de las mismas predicciones. Dado que
+        la salida de la red neuronal utiliza hot-encoding, debemos 
+        traducirlas a valores de clase. Para ello podemos utilizar la función
+        argmax de Numpy.
         """
-        val_predict = np.argmax(self.model.predict(self.validation_iterator),
-                                axis=1)
+        val_predict = np.argmax(val_probabilities, axis=1)
         # Obtener las clases reales de cada imagen del conjunto de validación.
         val_targets = self.validation_iterator.labels
 
@@ -157,21 +167,12 @@ class ModelMetrics(Callback):
     def get_isic_2019_balanced_accuracy(self) -> float:
         """
         Calcula el balanced multi-class accuracy utilizando el módulo
-        isic_2019_scoring.
+        isic_2019_scoring a partir del fichero de predicciones del conjunto
+        de validación grabado previamente en el directorio temporal.
 
         :return: valor del balanced multi-class accuracy definido por ISIC 2019.
         """
 
-        """
-        Graba las predicciones del conjunto de validación en un fichero 
-        temporal. Si ya existía (de una época anterior) simplemente se 
-        sobreescribirá.
-        """
-        self.model_manager.generate_submission_file(
-            image_iterator=self.validation_iterator,
-            directory=self.temp_dir,
-            filename='predictions.csv')
-
         """
         Utiliza el módulo de ISIC 2019 para obtener el balanced multi-class 
         accuracy y devolver su valor.
@@ -2,11 +2,11 @@
 Esta clase reúne toda la funcionalidad para presentar gráficas y otras
 visualizaciones de resultados.
 """
+import csv
 import itertools
 
 import matplotlib.pyplot as plt
 import numpy as np
-from pandas import DataFrame
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.metrics import f1_score, precision_score, recall_score, \
     balanced_accuracy_score
@@ -19,7 +19,29 @@ class ReportManager:
     """
 
     @staticmethod
-    def plot_accuracy_loss(history: DataFrame, title: str) -> None:
+    def read_history(filename: str) -> dict:
+        """
+        Lee un fichero de métricas grabado por el callback CSVLogger durante
+        el entrenamiento. Estos ficheros son muy pequeños (una línea por
+        época), así que se leen directamente con el módulo csv.
+
+        :param filename: ruta al fichero de métricas.
+        :return: diccionario que asocia el nombre de cada métrica con la
+        lista de sus valores por época.
+        """
+        with open(file=filename, mode='r', encoding='UTF8', newline='') as f:
+            rows = list(csv.DictReader(f))
+
+        if not rows:
+            return {}
+
+        return {
+            key: [float(row[key]) if row[key] not in ('', 'NA')
+                  else float('nan') for row in rows]
+            for key in rows[0].keys()}
+
+    @staticmethod
+    def plot_accuracy_loss(history: dict, title: str) -> None:
         """
         Método que muestra las gráficas de evolución de accuracy y pérdida
         de un modelo tanto durante el entrenamiento como la validación a partir
@@ -56,7 +78,7 @@ class ReportManager:
         plt.show()
 
     @staticmethod
-    def plot_model_metrics(history: DataFrame, title: str) -> None:
+    def plot_model_metrics(history: dict, title: str) -> None:
         """
         Función que muestra las gráficas de evolución de las métricas:
         - macro average F1 score
@@ -5,6 +5,7 @@ import tensorflow as tf
 from keras_preprocessing.image import ImageDataGenerator, DataFrameIterator
 
 from classes.BaseModelFactory import BaseModelFactory
+from classes.BrightnessAugmentation import BrightnessAugmentation
 from classes.DatasetManager import DatasetManager
 from classes.ReportManager import ReportManager
 
@@ -82,7 +83,10 @@ class EnsembleModelManager:
                     filename.rpartition('.')[0],
                     tf.keras.models.load_model(
                         filepath=self.ensemble_models_dir + "/" +
-                        self.ensemble_model_version + "/" + filename)
+                        self.ensemble_model_version + "/" + filename,
+                        custom_objects={
+                            "BrightnessAugmentation": BrightnessAugmentation
+                        })
                 )
             )
 